@@ -76,6 +76,30 @@ class VGGFace2(Extractor):  # pylint:disable=abstract-method
         preds = self.model.predict(face)
         return preds[0, :]
 
+    def predict_batch(self, faces, batch_size=64):
+        """ Return encodings for a batch of faces from vgg_face2.
+
+        Feeding faces to the model in batches avoids the overhead of dispatching a separate
+        inference call for every face.
+
+        Parameters
+        ----------
+        faces: numpy.ndarray
+            The stacked (`N`, `height`, `width`, `channels`) faces to be fed through the
+            predictor. Should be in BGR channel order
+        batch_size: int, optional
+            The batch size to run inference at. Default: `64`
+
+        Returns
+        -------
+        numpy.ndarray
+            The (`N`, `D`) encodings for the faces
+        """
+        if faces.shape[1] != self.input_size:
+            faces = np.array([self._resize_face(face) for face in faces])
+        feed = faces[..., :3] - self._average_img
+        return self.model.predict(feed, batch_size=batch_size)
+
     def _resize_face(self, face):
         """ Resize incoming face to model_input_size.
 
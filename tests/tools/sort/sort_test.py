@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+""" Tests for Faceswap Sort tool. """
+import os
+
+import numpy as np
+import pytest
+
+from tools.sort import sort
+from tools.sort.sort import Sort, _HistogramCache
+
+_POINT_COUNTS = [0, 1, 2, 3, 40]
+_POINT_IDS = [f"points_{count}" for count in _POINT_COUNTS]
+
+
+def _random_points(num_points, tied):
+    """ Create (`N`, 16) float32 points. Tied points are small integers, so that many values are
+    repeated, and integer valued so that all distances are exact """
+    rng = np.random.default_rng(num_points)
+    if tied:
+        return rng.integers(0, 4, (num_points, 16)).astype("float32")
+    return rng.random((num_points, 16), dtype="float32")
+
+
+def _brute_force_chain(points, similarity):
+    """ Order points with the original nested loop, moving the closest remaining point to the
+    next position in the chain """
+    points = list(enumerate(points))
+    for i in range(len(points) - 1):
+        best_score = float("-inf") if similarity else float("inf")
+        j_best = i + 1
+        for j in range(i + 1, len(points)):
+            if similarity:
+                score = np.dot(points[j][1], points[i][1])
+                is_best = score > best_score
+            else:
+                score = np.sum(np.absolute(points[j][1] - points[i][1]))
+                is_best = score < best_score
+            if is_best:
+                best_score = score
+                j_best = j
+        points[i + 1], points[j_best] = points[j_best], points[i + 1]
+    return [idx for idx, _ in points]
+
+
+@pytest.mark.parametrize("num_points", _POINT_COUNTS, ids=_POINT_IDS)
+@pytest.mark.parametrize("tied", [False, True], ids=["random", "tied"])
+def test_sum_l1_distances(num_points, tied):
+    """ Test that the rank based L1 distance totals match all pairs brute force totals """
+    points = _random_points(num_points, tied)
+    expected = np.abs(points[:, None].astype("float64") - points[None]).sum(axis=(1, 2))
+
+    result = Sort._sum_l1_distances(points)  # pylint:disable=protected-access
+    assert result.shape == (num_points, )
+    np.testing.assert_allclose(result, expected, rtol=1e-6)
+
+
+@pytest.mark.parametrize("num_points", _POINT_COUNTS, ids=_POINT_IDS)
+@pytest.mark.parametrize("similarity", [False, True], ids=["distance", "similarity"])
+def test_greedy_chain(num_points, similarity):
+    """ Test that the greedy chain gives the same order as the original nested loop """
+    points = _random_points(num_points, tied=True)
+    expected = _brute_force_chain(points, similarity)
+
+    order = Sort._greedy_chain(points.copy(),  # pylint:disable=protected-access
+                               "Testing",
+                               similarity=similarity)
+    assert order.tolist() == expected
+
+
+def _write_file(folder, filename, contents):
+    """ Write a file for the histogram cache to index. Only the file's stats are used by the
+    cache, so the contents do not need to be a valid image. """
+    path = os.path.join(folder, filename)
+    with open(path, "wb") as out_file:
+        out_file.write(contents)
+    return path
+
+
+def _histogram(value):
+    """ Create a (256, 1) histogram filled with the given value """
+    return np.full((256, 1), value, dtype="float32")
+
+
+def _populated_cache(folder):
+    """ Write two files to the given folder and save their histograms to a new cache """
+    filenames = [_write_file(folder, "a.png", b"a" * 16), _write_file(folder, "b.png", b"b" * 16)]
+    _HistogramCache(folder).save([(filename, _histogram(idx + 1))
+                                  for idx, filename in enumerate(filenames)])
+    return filenames
+
+
+def test_histogram_cache_hit(tmp_path):
+    """ Test that unchanged files are retrieved from the cache on a rerun """
+    folder = str(tmp_path)
+    filenames = _populated_cache(folder)
+
+    cache = _HistogramCache(folder)
+    assert len(cache) == 2
+    for idx, filename in enumerate(filenames):
+        hist = cache.get(filename)
+        assert hist.shape == (256, 1)
+        np.testing.assert_array_equal(hist, _histogram(idx + 1))
+
+
+def test_histogram_cache_miss_rewritten(tmp_path):
+    """ Test that a file which has been rewritten is not retrieved from the cache """
+    folder = str(tmp_path)
+    filenames = _populated_cache(folder)
+    _write_file(folder, "a.png", b"c" * 32)
+
+    cache = _HistogramCache(folder)
+    assert cache.get(filenames[0]) is None
+    assert cache.get(filenames[1]) is not None
+
+
+def test_histogram_cache_miss_renamed_over(tmp_path):
+    """ Test that a different file, with the same size and modification time, that has been
+    renamed over a cached filename is not retrieved from the cache """
+    folder = str(tmp_path)
+    filenames = _populated_cache(folder)
+    stats = os.stat(filenames[0])
+    os.utime(filenames[1], ns=(stats.st_atime_ns, stats.st_mtime_ns))
+    os.replace(filenames[1], filenames[0])
+
+    assert _HistogramCache(folder).get(filenames[0]) is None
+
+
+def test_histogram_cache_out_of_sync(tmp_path):
+    """ Test that a cache whose index does not match its histograms is ignored """
+    folder = str(tmp_path)
+    filenames = _populated_cache(folder)
+    np.save(os.path.join(folder, ".fs_hists.npy"), np.stack([_histogram(1)]))
+
+    cache = _HistogramCache(folder)
+    assert len(cache) == 0
+    assert all(cache.get(filename) is None for filename in filenames)
+
+    cache.save([(filenames[0], _histogram(3))])
+    np.testing.assert_array_equal(_HistogramCache(folder).get(filenames[0]), _histogram(3))
+
+
+def test_histogram_cache_failed_save(tmp_path, monkeypatch):
+    """ Test that a save which fails part way through leaves no usable cache and no temporary
+    files behind """
+    folder = str(tmp_path)
+    filenames = _populated_cache(folder)
+
+    def failed_replace(src, dst):
+        raise OSError(f"Unable to replace '{dst}' with '{src}'")
+
+    monkeypatch.setattr(sort.os, "replace", failed_replace)
+    cache = _HistogramCache(folder)
+    cache.save([(filenames[0], _histogram(3))])
+    monkeypatch.undo()
+
+    assert sorted(os.listdir(folder)) == [".fs_hists.npy", "a.png", "b.png"]
+    cache = _HistogramCache(folder)
+    assert len(cache) == 0
+    assert all(cache.get(filename) is None for filename in filenames)
+
+
+def test_histogram_cache_save_removed(tmp_path):
+    """ Test that saving removes the entries for faces that are no longer in the folder, and
+    that saving no histograms removes the cache """
+    folder = str(tmp_path)
+    filenames = _populated_cache(folder)
+
+    _HistogramCache(folder).save([(filenames[1], _histogram(2))])
+    cache = _HistogramCache(folder)
+    assert len(cache) == 1
+    assert cache.get(filenames[0]) is None
+
+    cache.save([])
+    assert sorted(os.listdir(folder)) == ["a.png", "b.png"]
+    assert len(_HistogramCache(folder)) == 0
@@ -6,23 +6,27 @@ import logging
 import os
 import sys
 import operator
+from collections import deque
 from concurrent import futures
-from shutil import copyfile
+from functools import partial
+from shutil import copy
 
 import numpy as np
 import cv2
 from tqdm import tqdm
 
 # faceswap imports
-from lib.serializer import get_serializer_from_filename
-from lib.align import AlignedFace, DetectedFace
-from lib.image import FacesLoader, read_image, read_image_meta_batch
+from lib.serializer import get_serializer, get_serializer_from_filename
+from lib.align import AlignedFace, DetectedFace, Mask
+from lib.image import FacesLoader, read_image, read_image_meta
 from lib.utils import FaceswapError
 from plugins.extract.recognition.vgg_face2_keras import VGGFace2 as VGGFace
 from plugins.extract.pipeline import Extractor, ExtractMedia
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
+_IMAGE_EXTENSIONS = frozenset((".jpg", ".png", ".jpeg"))
+
 
 class Sort():
     """ Sorts folders of faces based on input criteria """
@@ -103,18 +107,19 @@ class Sort():
     def _get_landmarks(self):
         """ Multi-threaded, parallel and sequentially ordered landmark loader """
         extractor = self.launch_aligner()
-        filename_list, image_list = self._get_images()
-        feed_list = list(map(Sort.alignment_dict, filename_list, image_list))
-        landmarks = np.zeros((len(feed_list), 68, 2), dtype='float32')
+        filename_list = self.find_images(self._args.input_dir)
+        landmarks = np.zeros((len(filename_list), 68, 2), dtype='float32')
 
         logger.info("Finding landmarks in images...")
         # TODO thread the put to queue so we don't have to put and get at the same time
-        # Or even better, set up a proper background loader from disk (i.e. use lib.image.ImageIO)
-        for idx, feed in enumerate(tqdm(feed_list, desc="Aligning", file=sys.stdout)):
-            extractor.input_queue.put(feed)
+        for idx, (filename, image) in enumerate(tqdm(self._stream_images(filename_list),
+                                                     desc="Aligning",
+                                                     total=len(filename_list),
+                                                     file=sys.stdout)):
+            extractor.input_queue.put(Sort.alignment_dict(filename, image))
             landmarks[idx] = next(extractor.detected_faces()).detected_faces[0].landmarks_xy
 
-        return filename_list, image_list, landmarks
+        return filename_list, landmarks
 
     def _get_images(self):
         """ Multi-threaded, parallel and sequentially ordered image loader """
@@ -128,6 +133,114 @@ class Sort():
 
         return filename_list, image_list
 
+    def _stream_images(self, filename_list, queue_depth=64):
+        """ Multi-threaded, sequentially ordered image generator.
+
+        Unlike :func:`_get_images` only a bounded number of images are held in memory at any one
+        time, so this should be used wherever the images only need to be processed once.
+
+        Parameters
+        ----------
+        filename_list: list
+            The full paths to the images to be loaded
+        queue_depth: int, optional
+            The maximum number of images to be read ahead of the consumer. Default: `64`
+
+        Yields
+        ------
+        filename: str
+            The filename of the loaded image
+        image: :class:`numpy.ndarray`
+            The loaded image
+        """
+        logger.info("Loading images...")
+        yield from self._threaded_map(lambda filename: (filename, read_image(filename)),
+                                      ((filename, ) for filename in filename_list),
+                                      queue_depth)
+
+    def _prefetch_aligned_faces(self, description, process, size=None, queue_depth=128):
+        """ Load faces with their metadata and align them in a background thread pool.
+
+        Faces are aligned ahead of the consumer, so that alignment of the next faces continues
+        whilst the caller is processing the current ones. Results are yielded in load order.
+
+        Parameters
+        ----------
+        description: str
+            The description to display in the progress bar
+        process: callable
+            Function that accepts an :class:`lib.align.AlignedFace` and returns the value that is
+            required from it. Executed within the worker thread
+        size: int, optional
+            The size of the aligned face image to extract. ``None`` to skip extracting the face
+            image when only the landmark data is required. Default: ``None``
+        queue_depth: int, optional
+            The maximum number of faces to be queued for alignment ahead of the consumer.
+            Default: `128`
+
+        Yields
+        ------
+        filename: str
+            The filename of the aligned face
+        result:
+            The output from :attr:`process` for the aligned face
+        """
+        kwargs = dict(centering="legacy", is_aligned=True)
+        if size is not None:
+            kwargs["size"] = size
+
+        def align(filename, image, metadata):
+            """ Align a face from its metadata and return the requested value """
+            landmarks = self._landmarks_from_alignments(metadata["alignments"])
+            return filename, process(AlignedFace(landmarks,
+                                                 image=None if size is None else image,
+                                                 **kwargs))
+
+        def load():
+            """ Load the faces, ensuring that they contain alignment data """
+            for filename, image, metadata in tqdm(self._loader.load(),
+                                                  desc=description,
+                                                  total=self._loader.count,
+                                                  leave=False):
+                if not metadata:
+                    msg = ("The images to be sorted do not contain alignment data. Images must "
+                           "have been generated by Faceswap's Extract process.\nIf you are "
+                           "sorting an older faceset, then you should re-extract the faces from "
+                           "your source alignments file to generate this data.")
+                    raise FaceswapError(msg)
+                yield filename, image, metadata
+
+        yield from self._threaded_map(align, load(), queue_depth)
+
+    @staticmethod
+    def _threaded_map(function, iterable, queue_depth):
+        """ Lazily map a function over an iterable in a thread pool, returning results in order.
+
+        The iterable is consumed in the calling thread, and no more than :attr:`queue_depth`
+        items are submitted ahead of the consumer, so that memory use remains bounded.
+
+        Parameters
+        ----------
+        function: callable
+            The function to execute within the worker threads
+        iterable: iterable
+            An iterable of argument tuples to be passed to :attr:`function`
+        queue_depth: int
+            The maximum number of tasks to submit ahead of the consumer
+
+        Yields
+        ------
+        The output from :attr:`function` for each item in :attr:`iterable`, in order
+        """
+        pending = deque()
+        with futures.ThreadPoolExecutor() as executor:
+            for args in iterable:
+                pending.append(executor.submit(function, *args))
+                if len(pending) >= queue_depth:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
     def sort_process(self):
         """
         This method dynamically assigns the functions that will be used to run
@@ -156,14 +269,13 @@ class Sort():
         """ Sort by comparison of face landmark points to mean face by average distance of core
         landmarks. """
         logger.info("Sorting by average distance of landmarks...")
-        filenames = []
-        distances = []
-        filelist = [os.path.join(self._loader.location, fname)
-                    for fname in os.listdir(self._loader.location)
-                    if os.path.splitext(fname)[-1] == ".png"]
-        for filename, metadata in tqdm(read_image_meta_batch(filelist),
-                                       total=len(filelist),
-                                       desc="Calculating Distances"):
+        with os.scandir(self._loader.location) as entries:
+            filelist = [entry.path for entry in entries
+                        if entry.name.endswith(".png") and entry.is_file()]
+
+        def get_distance(filename):
+            """ Read the metadata for a face and calculate its average landmark distance """
+            metadata = read_image_meta(filename)
             if not metadata:
                 msg = ("The images to be sorted do not contain alignment data. Images must have "
                        "been generated by Faceswap's Extract process.\nIf you are sorting an "
@@ -171,12 +283,16 @@ class Sort():
                        "alignments file to generate this data.")
                 raise FaceswapError(msg)
             alignments = metadata["itxt"]["alignments"]
-            aligned_face = AlignedFace(np.array(alignments["landmarks_xy"], dtype="float32"))
-            filenames.append(filename)
-            distances.append(aligned_face.average_distance)
+            aligned_face = AlignedFace(self._landmarks_from_alignments(alignments))
+            return filename, aligned_face.average_distance
+
+        matched_list = list(tqdm(self._threaded_map(get_distance,
+                                                    ((filename, ) for filename in filelist),
+                                                    256),
+                                 total=len(filelist),
+                                 desc="Calculating Distances"))
 
         logger.info("Sorting...")
-        matched_list = list(zip(filenames, distances))
         img_list = sorted(matched_list, key=operator.itemgetter(1))
         return img_list
 
@@ -184,11 +300,7 @@ class Sort():
         """ Sort by blur amount """
         logger.info("Sorting by estimated image blur...")
 
-        blurs = [(filename, self.estimate_blur(image, metadata))
-                 for filename, image, metadata in tqdm(self._loader.load(),
-                                                       desc="Estimating blur",
-                                                       total=self._loader.count,
-                                                       leave=False)]
+        blurs = self._estimate_blur_batched(self._laplacian_blur_scores, "Estimating blur")
         logger.info("Sorting...")
         return sorted(blurs, key=lambda x: x[1], reverse=True)
 
@@ -196,14 +308,84 @@ class Sort():
         """ Sort by fft filtered blur amount with fft"""
         logger.info("Sorting by estimated fft filtered image blur...")
 
-        fft_blurs = [(filename, self.estimate_blur_fft(image, metadata))
-                     for filename, image, metadata in tqdm(self._loader.load(),
-                                                           desc="Estimating fft blur score",
-                                                           total=self._loader.count,
-                                                           leave=False)]
+        fft_blurs = self._estimate_blur_batched(self._fft_blur_scores,
+                                                "Estimating fft blur score")
         logger.info("Sorting...")
         return sorted(fft_blurs, key=lambda x: x[1], reverse=True)
 
+    def _estimate_blur_batched(self, score_function, description, filename_list=None,
+                               batch_size=64, queue_depth=8):
+        """ Estimate the blur for each face in the faces folder, scoring faces in batches.
+
+        Consecutive faces that share the same dimensions (which is always the case for masked
+        faces) are stacked, converted to grayscale and scored together, rather than dispatching
+        the conversion and scoring calculations for each face individually. Each batch is masked,
+        converted and scored within a thread pool.
+
+        Parameters
+        ----------
+        score_function: callable
+            The batch scoring function to use. Either :func:`_laplacian_blur_scores` or
+            :func:`_fft_blur_scores`
+        description: str
+            The description to display in the progress bar
+        filename_list: list, optional
+            The full paths to the images to score without masking, or ``None`` to score the masked
+            faces from the faces folder. Default: ``None``
+        batch_size: int, optional
+            The maximum number of faces to score in each batch. Default: `64`
+        queue_depth: int, optional
+            The maximum number of batches to be scored ahead of the consumer. Default: `8`
+
+        Returns
+        -------
+        list
+            List of (`filename`, `score`) tuples in load order
+        """
+        if filename_list is None:
+            # Faces are aligned and their masks loaded ahead of the consumer in a thread pool
+            faces = self._threaded_map(self._prepare_blur_face,
+                                       tqdm(self._loader.load(),
+                                            desc=description,
+                                            total=self._loader.count,
+                                            leave=False),
+                                       128)
+        else:
+            faces = tqdm(((filename, image, None)
+                          for filename, image in self._stream_images(filename_list)),
+                         desc=description,
+                         total=len(filename_list),
+                         file=sys.stdout)
+
+        def get_batches():
+            """ Group consecutive faces that share the same dimensions into batches """
+            filenames = []
+            batch = []
+            batch_shape = None
+            for filename, image, aligned in faces:
+                shape = image.shape if aligned is None else aligned[0].face.shape
+                if batch and (len(batch) == batch_size or shape != batch_shape):
+                    yield filenames, batch
+                    filenames, batch = [], []
+                filenames.append(filename)
+                batch.append((image, aligned))
+                batch_shape = shape
+            if batch:
+                yield filenames, batch
+
+        def score_batch(filenames, batch):
+            """ Mask, convert and score a batch of faces within a worker thread """
+            mask_buffer = np.empty((256, 256), dtype="uint8")
+            images = np.stack([image if aligned is None
+                               else self._apply_blur_mask(*aligned, mask_buffer=mask_buffer)
+                               for image, aligned in batch])
+            return zip(filenames, score_function(self._batch_to_gray(images)).tolist())
+
+        retval = []
+        for scores in self._threaded_map(score_batch, get_batches(), queue_depth):
+            retval.extend(scores)
+        return retval
+
     def sort_color(self):
         """ Score by channel average intensity """
         logger.info("Sorting by channel average intensity...")
@@ -212,17 +394,26 @@ class Sort():
         channel_to_sort = next(v for (k, v) in desired_channel.items() if method.endswith(k))
         filename_list, image_list = self._get_images()
 
-        logger.info("Converting to appropriate colorspace...")
-        same_size = all(img.size == image_list[0].size for img in image_list)
-        images = np.array(image_list, dtype='float32')[None, ...] if same_size else image_list
-        converted_images = self._convert_color(images, same_size, method)
-
-        logger.info("Scoring each image...")
+        logger.info("Converting to appropriate colorspace and scoring each image...")
+        same_size = all(img.shape == image_list[0].shape for img in image_list)
         if same_size:
-            scores = np.average(converted_images[0], axis=(1, 2))
+            # Convert and reduce in chunks so the full float32 stack is never held in memory
+            chunk_size = 64
+            scores = None
+            for start in tqdm(range(0, len(image_list), chunk_size),
+                              desc="Converting",
+                              file=sys.stdout):
+                images = np.stack(image_list[start:start + chunk_size])
+                averages = self._convert_color(images, same_size, method).mean(axis=(1, 2))
+                if scores is None:
+                    scores = np.empty((len(image_list), averages.shape[-1]), dtype="float32")
+                scores[start:start + chunk_size] = averages
         else:
-            progress_bar = tqdm(converted_images, desc="Scoring", file=sys.stdout)
-            scores = np.array([np.average(image, axis=(0, 1)) for image in progress_bar])
+            converted_images = self._convert_color(image_list, same_size, method)
+            num_channels = converted_images[0].shape[-1]
+            scores = np.empty((len(converted_images), num_channels), dtype="float32")
+            for idx, image in enumerate(tqdm(converted_images, desc="Scoring", file=sys.stdout)):
+                scores[idx] = cv2.mean(image)[:num_channels]
 
         logger.info("Sorting...")
         matched_list = list(zip(filename_list, scores[:, channel_to_sort]))
@@ -232,72 +423,50 @@ class Sort():
     def sort_face(self):
         """ Sort by identity similarity """
         logger.info("Sorting by identity similarity...")
+        batch_size = 64
         filenames = []
+        faces = []
         preds = []
-        for filename, image, metadata in tqdm(self._loader.load(),
-                                              desc="Classifying Faces",
-                                              total=self._loader.count,
-                                              leave=False):
-            if not metadata:
-                msg = ("The images to be sorted do not contain alignment data. Images must have "
-                       "been generated by Faceswap's Extract process.\nIf you are sorting an "
-                       "older faceset, then you should re-extract the faces from your source "
-                       "alignments file to generate this data.")
-                raise FaceswapError(msg)
-            alignments = metadata["alignments"]
-            face = AlignedFace(np.array(alignments["landmarks_xy"], dtype="float32"),
-                               image=image,
-                               centering="legacy",
-                               size=self._vgg_face.input_size,
-                               is_aligned=True).face
+        for filename, face in self._prefetch_aligned_faces("Classifying Faces",
+                                                           operator.attrgetter("face"),
+                                                           size=self._vgg_face.input_size):
             filenames.append(filename)
-            preds.append(self._vgg_face.predict(face))
+            faces.append(face)
+            if len(faces) == batch_size:
+                preds.append(self._vgg_face.predict_batch(np.stack(faces), batch_size=batch_size))
+                faces = []
+        if faces:
+            preds.append(self._vgg_face.predict_batch(np.stack(faces), batch_size=batch_size))
+        if not preds:
+            return []
 
         logger.info("Sorting by ward linkage...")
 
-        indices = self._vgg_face.sorted_similarity(np.array(preds), method="ward")
+        indices = self._vgg_face.sorted_similarity(np.concatenate(preds), method="ward")
         img_list = np.array(filenames)[indices]
         return img_list
 
     def sort_face_cnn(self):
         """ Sort by landmark similarity """
         logger.info("Sorting by landmark similarity...")
-        filename_list, _, landmarks = self._get_landmarks()
+        filename_list, landmarks = self._get_landmarks()
         img_list = list(zip(filename_list, landmarks))
 
         logger.info("Comparing landmarks and sorting...")
-        img_list_len = len(img_list)
-        for i in tqdm(range(0, img_list_len - 1), desc="Comparing", file=sys.stdout):
-            min_score = float("inf")
-            j_min_score = i + 1
-            for j in range(i + 1, img_list_len):
-                fl1 = img_list[i][1]
-                fl2 = img_list[j][1]
-                score = np.sum(np.absolute((fl2 - fl1).flatten()))
-                if score < min_score:
-                    min_score = score
-                    j_min_score = j
-            (img_list[i + 1], img_list[j_min_score]) = (img_list[j_min_score], img_list[i + 1])
-        return img_list
+        # Copy, as the chain is built in place and the landmarks are returned with the filenames
+        flat_landmarks = landmarks.reshape(len(landmarks), 68 * 2).copy()
+        order = self._greedy_chain(flat_landmarks, "Comparing")
+        return [img_list[idx] for idx in order]
 
     def sort_face_cnn_dissim(self):
         """ Sort by landmark dissimilarity """
         logger.info("Sorting by landmark dissimilarity...")
-        filename_list, _, landmarks = self._get_landmarks()
-        scores = np.zeros(len(filename_list), dtype='float32')
-        img_list = list(list(items) for items in zip(filename_list, landmarks, scores))
+        filename_list, landmarks = self._get_landmarks()
+        flat_landmarks = landmarks.reshape(len(landmarks), 68 * 2)
 
         logger.info("Comparing landmarks...")
-        img_list_len = len(img_list)
-        for i in tqdm(range(0, img_list_len - 1), desc="Comparing", file=sys.stdout):
-            score_total = 0
-            for j in range(i + 1, img_list_len):
-                if i == j:
-                    continue
-                fl1 = img_list[i][1]
-                fl2 = img_list[j][1]
-                score_total += np.sum(np.absolute((fl2 - fl1).flatten()))
-            img_list[i][2] = score_total
+        scores = self._sum_l1_distances(flat_landmarks).astype("float32")
+        img_list = list(list(items) for items in zip(filename_list, landmarks, scores))
 
         logger.info("Sorting...")
         img_list = sorted(img_list, key=operator.itemgetter(2), reverse=True)
@@ -306,28 +475,17 @@ class Sort():
     def sort_face_yaw(self):
         """ Sort by estimated face yaw angle """
         logger.info("Sorting by estimated face yaw angle..")
-        filenames = []
-        yaws = []
-        for filename, image, metadata in tqdm(self._loader.load(),
-                                              desc="Classifying Faces",
-                                              total=self._loader.count,
-                                              leave=False):
-            if not metadata:
-                msg = ("The images to be sorted do not contain alignment data. Images must have "
-                       "been generated by Faceswap's Extract process.\nIf you are sorting an "
-                       "older faceset, then you should re-extract the faces from your source "
-                       "alignments file to generate this data.")
-                raise FaceswapError(msg)
-            alignments = metadata["alignments"]
-            aligned_face = AlignedFace(np.array(alignments["landmarks_xy"], dtype="float32"),
-                                       image=image,
-                                       centering="legacy",
-                                       is_aligned=True)
-            filenames.append(filename)
-            yaws.append(aligned_face.pose.yaw)
+        filenames = [None] * self._loader.count
+        yaws = np.empty(self._loader.count, dtype="float32")
+        num_faces = 0
+        for filename, yaw in self._prefetch_aligned_faces("Classifying Faces",
+                                                          operator.attrgetter("pose.yaw")):
+            filenames[num_faces] = filename
+            yaws[num_faces] = yaw
+            num_faces += 1
 
         logger.info("Sorting...")
-        matched_list = list(zip(filenames, yaws))
+        matched_list = list(zip(filenames[:num_faces], yaws[:num_faces].tolist()))
         img_list = sorted(matched_list, key=operator.itemgetter(1), reverse=True)
         return img_list
 
@@ -335,75 +493,84 @@ class Sort():
         """ Sort by image histogram similarity """
         logger.info("Sorting by histogram similarity...")
 
-        # TODO We have metadata here, so we can mask the face for hist sorting
-        img_list = [(filename, cv2.calcHist([image], [0], None, [256], [0, 256]))
-                    for filename, image, _ in tqdm(self._loader.load(),
-                                                   desc="Calculating histograms",
-                                                   total=self._loader.count,
-                                                   leave=False)]
+        img_list = self._get_histograms()
 
         logger.info("Comparing histograms and sorting...")
-        img_list_len = len(img_list)
-        for i in tqdm(range(0, img_list_len - 1), desc="Comparing histograms", file=sys.stdout):
-            min_score = float("inf")
-            j_min_score = i + 1
-            for j in range(i + 1, img_list_len):
-                score = cv2.compareHist(img_list[i][1], img_list[j][1], cv2.HISTCMP_BHATTACHARYYA)
-                if score < min_score:
-                    min_score = score
-                    j_min_score = j
-            (img_list[i + 1], img_list[j_min_score]) = (img_list[j_min_score], img_list[i + 1])
-        return img_list
+        roots = self._normalized_histogram_roots([hist for _, hist in img_list])
+        # Bhattacharyya distance is smallest where the Bhattacharyya coefficient is largest
+        order = self._greedy_chain(roots, "Comparing histograms", similarity=True)
+        return [img_list[idx] for idx in order]
 
     def sort_hist_dissim(self):
         """ Sort by image histogram dissimilarity """
         logger.info("Sorting by histogram dissimilarity...")
 
-        # TODO We have metadata here, so we can mask the face for hist sorting
-        img_list = [[filename, cv2.calcHist([image], [0], None, [256], [0, 256]), 0.0]
-                    for filename, image, _ in tqdm(self._loader.load(),
-                                                   desc="Calculating histograms",
-                                                   total=self._loader.count,
-                                                   leave=False)]
+        img_list = [[filename, hist, 0.0] for filename, hist in self._get_histograms()]
 
+        roots = self._normalized_histogram_roots([item[1] for item in img_list])
         img_list_len = len(img_list)
-        for i in tqdm(range(0, img_list_len), desc="Comparing histograms", file=sys.stdout):
-            score_total = 0
-            for j in range(0, img_list_len):
-                if i == j:
-                    continue
-                score_total += cv2.compareHist(img_list[i][1],
-                                               img_list[j][1],
-                                               cv2.HISTCMP_BHATTACHARYYA)
-            img_list[i][2] = score_total
+        chunk_size = max(1, 2 ** 22 // max(1, img_list_len))
+        for start in tqdm(range(0, img_list_len, chunk_size),
+                          desc="Comparing histograms",
+                          file=sys.stdout):
+            chunk = roots[start:start + chunk_size]
+            distances = np.sqrt(np.clip(1.0 - chunk @ roots.T, 0.0, None))
+            distances[np.arange(len(chunk)), np.arange(start, start + len(chunk))] = 0.0
+            for idx, score_total in enumerate(distances.sum(axis=1)):
+                img_list[start + idx][2] = float(score_total)
 
         logger.info("Sorting...")
         return sorted(img_list, key=lambda x: x[2], reverse=True)
 
+    def _get_histograms(self):
+        """ Obtain the grayscale histogram for each face in the faces folder.
+
+        Histograms are persisted in the faces folder between runs, so only faces that are new or
+        have been modified since the last run need to be loaded and have their histogram
+        calculated.
+
+        Returns
+        -------
+        list
+            List of (`filename`, `histogram`) tuples in load order
+        """
+        cache = _HistogramCache(self._loader.location)
+        file_list = self._loader.file_list
+        histograms = [cache.get(filename) for filename in file_list]
+        cached = [idx for idx, hist in enumerate(histograms) if hist is not None]
+        logger.debug("Retrieved %s of %s histograms from cache", len(cached), len(file_list))
+
+        self._loader.add_skip_list(cached)
+        indices = {filename: idx for idx, filename in enumerate(file_list)}
+        # TODO We have metadata here, so we can mask the face for hist sorting
+        for filename, image, _ in tqdm(self._loader.load(),
+                                       desc="Calculating histograms",
+                                       total=self._loader.process_count,
+                                       leave=False):
+            histograms[indices[filename]] = self.calc_histogram(image)
+        self._loader.add_skip_list([])
+
+        retval = [(filename, hist)
+                  for filename, hist in zip(file_list, histograms) if hist is not None]
+        # Save if new histograms have been calculated or if faces have been removed from the folder
+        if len(cached) != len(retval) or len(retval) != len(cache):
+            cache.save(retval)
+        return retval
+
     def sort_size(self):
         """ Sort the faces by largest face (in original frame) to smallest """
         logger.info("Sorting by original face size...")
-        img_list = []
-        for filename, image, metadata in tqdm(self._loader.load(),
-                                              desc="Calculating face sizes",
-                                              total=self._loader.count,
-                                              leave=False):
-            if not metadata:
-                msg = ("The images to be sorted do not contain alignment data. Images must have "
-                       "been generated by Faceswap's Extract process.\nIf you are sorting an "
-                       "older faceset, then you should re-extract the faces from your source "
-                       "alignments file to generate this data.")
-                raise FaceswapError(msg)
-            alignments = metadata["alignments"]
-            aligned_face = AlignedFace(np.array(alignments["landmarks_xy"], dtype="float32"),
-                                       image=image,
-                                       centering="legacy",
-                                       is_aligned=True)
-            roi = aligned_face.original_roi
-            size = ((roi[1][0] - roi[0][0]) ** 2 + (roi[1][1] - roi[0][1]) ** 2) ** 0.5
-            img_list.append((filename, size))
+        filenames = [None] * self._loader.count
+        sizes = np.empty(self._loader.count, dtype="float32")
+        num_faces = 0
+        for filename, roi in self._prefetch_aligned_faces("Calculating face sizes",
+                                                          operator.attrgetter("original_roi")):
+            filenames[num_faces] = filename
+            sizes[num_faces] = ((roi[1][0] - roi[0][0]) ** 2 + (roi[1][1] - roi[0][1]) ** 2) ** 0.5
+            num_faces += 1
 
         logger.info("Sorting...")
+        img_list = list(zip(filenames[:num_faces], sizes[:num_faces].tolist()))
         return sorted(img_list, key=lambda x: x[1], reverse=True)
 
     def sort_black_pixels(self):
@@ -412,19 +579,13 @@ class Sort():
          Calculates the sum of black pixels, get the percentage X 3 channels
         """
         logger.info("Sorting by percentage of black pixels...")
-        img_list = [(filename, np.ndarray.all(image == [0, 0, 0], axis=2).sum()/image.size*100*3)
+        img_list = [(filename, self.calc_black_pixels(image))
                     for filename, image, _ in tqdm(self._loader.load(),
                                                    desc="Calculating black pixels",
                                                    total=self._loader.count,
                                                    leave=False)]
-        img_list_len = len(img_list)
-        for i in tqdm(range(0, img_list_len - 1), desc="Comparing black pixels", file=sys.stdout):
-            for j in range(0, img_list_len-i-1):
-                if img_list[j][1] > img_list[j+1][1]:
-                    temp = img_list[j]
-                    img_list[j] = img_list[j+1]
-                    img_list[j+1] = temp
-        return img_list
+        logger.info("Sorting...")
+        return sorted(img_list, key=operator.itemgetter(1))
 
     # Methods for grouping
     def group_blur(self, img_list):
@@ -480,7 +641,13 @@ class Sort():
         logger.info("Grouping by face-cnn similarity...")
 
         # Groups are of the form: group_num -> reference faces
-        reference_groups = {}
+        reference_groups = []
+
+        # The mean of each group's reference faces. The average L1 distance from a face to a
+        # group's references can never be less than the L1 distance to their mean, so the
+        # distance to each centroid is a lower bound of that group's score, allowing groups that
+        # cannot beat the current best to be skipped without scoring all of their references.
+        centroids = _GrowableArray((68 * 2, ), dtype="float64")
 
         # Bins array, where index is the group number and value is
         # an array containing the file paths to the images in that group.
@@ -497,25 +664,28 @@ class Sort():
         for i in tqdm(range(0, img_list_len - 1),
                       desc="Grouping",
                       file=sys.stdout):
-            fl1 = img_list[i][1]
-
+            fl1 = np.asarray(img_list[i][1], dtype="float32").reshape(-1)
             current_best = [-1, float("inf")]
 
-            for key, references in reference_groups.items():
-                try:
-                    score = self.get_avg_score_faces_cnn(fl1, references)
-                except TypeError:
-                    score = float("inf")
-                except ZeroDivisionError:
-                    score = float("inf")
+            lower_bounds = np.abs(centroids.view - fl1).sum(axis=1)
+            for key in np.argsort(lower_bounds, kind="stable"):
+                if lower_bounds[key] >= min(current_best[1], min_threshold):
+                    break
+                score = self.get_avg_score_faces_cnn(fl1, reference_groups[key].view)
                 if score < current_best[1]:
                     current_best[0], current_best[1] = key, score
 
             if current_best[1] < min_threshold:
-                reference_groups[current_best[0]].append(fl1[0])
+                references = reference_groups[current_best[0]]
+                references.append(fl1)
+                centroid = centroids.view[current_best[0]]
+                centroid += (fl1 - centroid) / len(references)
                 bins[current_best[0]].append(img_list[i][0])
             else:
-                reference_groups[len(reference_groups)] = [img_list[i][1]]
+                references = _GrowableArray(fl1.shape)
+                references.append(fl1)
+                reference_groups.append(references)
+                centroids.append(fl1)
                 bins.append([img_list[i][0]])
 
         return bins
@@ -567,8 +737,11 @@ class Sort():
         """ Group into bins by histogram """
         logger.info("Grouping by histogram...")
 
-        # Groups are of the form: group_num -> reference histogram
-        reference_groups = {}
+        # Normalized histogram roots for each image, stored in a single contiguous block
+        roots = self._normalized_histogram_roots([item[1] for item in img_list])
+
+        # Groups are of the form: group_num -> reference histogram roots
+        reference_groups = [_GrowableArray(roots.shape[1:])]
 
         # Bins array, where index is the group number and value is
         # an array containing the file paths to the images in that group
@@ -577,23 +750,25 @@ class Sort():
         min_threshold = self._args.min_threshold
 
         img_list_len = len(img_list)
-        reference_groups[0] = [img_list[0][1]]
+        reference_groups[0].append(roots[0])
         bins.append([img_list[0][0]])
 
         for i in tqdm(range(1, img_list_len),
                       desc="Grouping",
                       file=sys.stdout):
             current_best = [-1, float("inf")]
-            for key, value in reference_groups.items():
-                score = self.get_avg_score_hist(img_list[i][1], value)
+            for key, references in enumerate(reference_groups):
+                score = self.get_avg_score_hist(roots[i], references.view)
                 if score < current_best[1]:
                     current_best[0], current_best[1] = key, score
 
             if current_best[1] < min_threshold:
-                reference_groups[current_best[0]].append(img_list[i][1])
+                reference_groups[current_best[0]].append(roots[i])
                 bins[current_best[0]].append(img_list[i][0])
             else:
-                reference_groups[len(reference_groups)] = [img_list[i][1]]
+                references = _GrowableArray(roots.shape[1:])
+                references.append(roots[i])
+                reference_groups.append(references)
                 bins.append([img_list[i][0]])
 
         return bins
@@ -603,8 +778,8 @@ class Sort():
         """ Rename the files """
         output_dir = self._args.output_dir
 
-        process_file = self.set_process_file_method(self._args.log_changes,
-                                                    self._args.keep_original)
+        # The final destination of each file is logged when it is renamed
+        process_file = self.set_process_file_method(False, self._args.keep_original)
 
         # Make sure output directory exists
         if not os.path.exists(output_dir):
@@ -615,35 +790,53 @@ class Sort():
             else "Moving and Renaming"
         )
 
-        for i in tqdm(range(0, len(img_list)),
-                      desc=description,
-                      leave=False,
-                      file=sys.stdout):
-            src = img_list[i] if isinstance(img_list[i], str) else img_list[i][0]
-            src_basename = os.path.basename(src)
+        filenames = [fname if isinstance(fname, str) else fname[0] for fname in img_list]
+        renaming = self.set_renaming_method(self._args.log_changes)
+        renames = [renaming(fname, output_dir, i, self.changes)
+                   for i, fname in enumerate(filenames)]
 
-            dst = os.path.join(output_dir, f"{i:05d}_{src_basename}")
-            try:
-                process_file(src, dst, self.changes)
-            except FileNotFoundError as err:
-                logger.error(err)
-                logger.error('fail to rename %s', src)
+        self._process_files_threaded(
+            partial(process_file, changes=self.changes),
+            [(src, temp) for src, (temp, _) in zip(filenames, renames)],
+            description,
+            leave=False)
+        self._process_files_threaded(os.replace, renames, description)
 
-        for i in tqdm(range(0, len(img_list)),
-                      desc=description,
-                      file=sys.stdout):
-            renaming = self.set_renaming_method(self._args.log_changes)
-            fname = img_list[i] if isinstance(img_list[i], str) else img_list[i][0]
-            src, dst = renaming(fname, output_dir, i, self.changes)
+        if self._args.log_changes:
+            self.write_to_log(self.changes)
 
+    @staticmethod
+    def _process_files_threaded(operation, file_pairs, description, leave=True):
+        """ Perform a file operation on a list of files, overlapping the operations in a thread
+        pool as they are bound by system calls.
+
+        Parameters
+        ----------
+        operation: callable
+            The file operation to perform. Should accept a source and destination path
+        file_pairs: list
+            List of (`source`, `destination`) paths to perform the operation on
+        description: str
+            The description to display in the progress bar
+        leave: bool, optional
+            ``True`` to leave the progress bar displayed on completion. Default: ``True``
+        """
+        def process(src, dst):
+            """ Perform the operation, logging any files that could not be found """
             try:
-                os.rename(src, dst)
+                operation(src, dst)
             except FileNotFoundError as err:
                 logger.error(err)
-                logger.error('fail to rename %s', format(src))
+                logger.error('fail to rename %s', src)
 
-        if self._args.log_changes:
-            self.write_to_log(self.changes)
+        with futures.ThreadPoolExecutor(max_workers=8) as executor:
+            jobs = [executor.submit(process, src, dst) for src, dst in file_pairs]
+            for job in tqdm(futures.as_completed(jobs),
+                            desc=description,
+                            total=len(jobs),
+                            leave=leave,
+                            file=sys.stdout):
+                job.result()
 
     def final_process_folders(self, bins):
         """ Move the files to folders """
@@ -699,34 +892,68 @@ class Sort():
         """
         logger.info("Preparing to group...")
         if group_method == 'group_blur':
-            filename_list, image_list = self._get_images()
-            blurs = [self.estimate_blur(img) for img in image_list]
-            temp_list = list(zip(filename_list, blurs))
+            temp_list = self._estimate_blur_batched(
+                self._laplacian_blur_scores,
+                "Estimating blur",
+                filename_list=self.find_images(self._args.input_dir))
         elif group_method == 'group_blur_fft':
-            filename_list, image_list = self._get_images()
-            fft_blurs = [self.estimate_blur_fft(img) for img in image_list]
-            temp_list = list(zip(filename_list, fft_blurs))
+            temp_list = self._estimate_blur_batched(
+                self._fft_blur_scores,
+                "Estimating fft blur score",
+                filename_list=self.find_images(self._args.input_dir))
         elif group_method == 'group_face_cnn':
-            filename_list, image_list, landmarks = self._get_landmarks()
+            filename_list, landmarks = self._get_landmarks()
             temp_list = list(zip(filename_list, landmarks))
         elif group_method == 'group_face_yaw':
-            filename_list, image_list, landmarks = self._get_landmarks()
-            yaws = [self.calc_landmarks_face_yaw(mark) for mark in landmarks]
+            filename_list, landmarks = self._get_landmarks()
+            yaws = self.calc_landmarks_face_yaw(landmarks).tolist()
             temp_list = list(zip(filename_list, yaws))
         elif group_method == 'group_hist':
-            filename_list, image_list = self._get_images()
-            histograms = [cv2.calcHist([img], [0], None, [256], [0, 256]) for img in image_list]
+            filename_list, histograms = self._map_images(self.calc_histogram,
+                                                         "Calculating histograms")
             temp_list = list(zip(filename_list, histograms))
         elif group_method == 'group_black_pixels':
-            filename_list, image_list = self._get_images()
-            black_pixels = [np.ndarray.all(img == [0, 0, 0], axis=2).sum()/img.size*100*3
-                            for img in image_list]
+            filename_list, black_pixels = self._map_images(self.calc_black_pixels,
+                                                           "Calculating black pixels")
             temp_list = list(zip(filename_list, black_pixels))
         else:
             raise ValueError(f"{group_method} group_method not found.")
 
         return self.splice_lists(img_list, temp_list)
 
+    def _map_images(self, function, description, queue_depth=64):
+        """ Load each image in the input folder and calculate a value for it in a thread pool.
+
+        Images are loaded and processed within the worker threads and are discarded once their
+        value has been calculated, so only a bounded number of images are held in memory at any
+        one time.
+
+        Parameters
+        ----------
+        function: callable
+            The function that calculates a value from an image
+        description: str
+            The description to display in the progress bar
+        queue_depth: int, optional
+            The maximum number of images to be processed ahead of the consumer. Default: `64`
+
+        Returns
+        -------
+        filename_list: list
+            The full paths to the images in the input folder
+        values: list
+            The calculated value for each image, in the same order as :attr:`filename_list`
+        """
+        logger.info("Loading images...")
+        filename_list = self.find_images(self._args.input_dir)
+        values = list(tqdm(self._threaded_map(lambda filename: function(read_image(filename)),
+                                              ((filename, ) for filename in filename_list),
+                                              queue_depth),
+                           desc=description,
+                           total=len(filename_list),
+                           file=sys.stdout))
+        return filename_list, values
+
     @staticmethod
     def _near_split(bin_range, num_bins):
         """ Obtain the split for the given number of bins for the given range
@@ -752,25 +979,151 @@ class Sort():
             uplimit += sep
         return bins
 
+    @staticmethod
+    def _greedy_chain(points, description, similarity=False):
+        """ Order points so that each point is followed by its nearest remaining neighbour.
+
+        The points are reordered in place as the chain is built, so that the remaining candidates
+        are always a contiguous block. All working buffers are allocated up front, so no new
+        arrays are created within the loop.
+
+        Parameters
+        ----------
+        points: :class:`numpy.ndarray`
+            The (`N`, `D`) float32 array of points to order. This array is modified in place
+        description: str
+            The description to display in the progress bar
+        similarity: bool, optional
+            ``True`` to select the next point by highest dot product. ``False`` to select by lowest
+            L1 distance. Default: ``False``
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            The (`N`, ) indices of the original points in chain order
+        """
+        num_points = points.shape[0]
+        order = np.arange(num_points)
+        if num_points < 2:
+            return order
+        scores = np.empty(num_points, dtype=points.dtype)
+        differences = None if similarity else np.empty_like(points)
+        swap = np.empty_like(points[0])
+
+        for i in tqdm(range(0, num_points - 1), desc=description, file=sys.stdout):
+            remaining = num_points - i - 1
+            if similarity:
+                np.dot(points[i + 1:], points[i], out=scores[:remaining])
+                j_best = i + 1 + int(scores[:remaining].argmax())
+            else:
+                np.subtract(points[i + 1:], points[i], out=differences[:remaining])
+                np.abs(differences[:remaining], out=differences[:remaining])
+                differences[:remaining].sum(axis=1, out=scores[:remaining])
+                j_best = i + 1 + int(scores[:remaining].argmin())
+
+            swap[:] = points[i + 1]
+            points[i + 1] = points[j_best]
+            points[j_best] = swap
+            order[i + 1], order[j_best] = order[j_best], order[i + 1]
+        return order
+
+    @staticmethod
+    def _sum_l1_distances(points):
+        """ Obtain the total L1 distance from each point to every other point.
+
+        Rather than comparing all pairs, each dimension is sorted once so that the sum of absolute
+        differences for a value can be calculated from its rank and the cumulative sum of the
+        values either side of it, reducing the calculation from O(N²) to O(N log N).
+
+        Parameters
+        ----------
+        points: :class:`numpy.ndarray`
+            The (`N`, `D`) array of points to compare
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            The (`N`, ) summed L1 distance from each point to all of the other points
+        """
+        num_points = points.shape[0]
+        if num_points == 0:
+            return np.zeros(0)
+        order = np.argsort(points, axis=0)
+        sorted_points = np.take_along_axis(points, order, axis=0).astype("float64")
+        cumulative = np.cumsum(sorted_points, axis=0)
+        ranks = np.arange(num_points, dtype="float64")[:, None]
+
+        below = sorted_points * ranks - (cumulative - sorted_points)
+        above = (cumulative[-1] - cumulative) - sorted_points * (num_points - 1 - ranks)
+        distances = np.empty_like(sorted_points)
+        np.put_along_axis(distances, order, below + above, axis=0)
+        return distances.sum(axis=1)
+
+    @staticmethod
+    def _normalized_histogram_roots(histograms):
+        """ Obtain the square root of each histogram once normalized to sum to 1.
+
+        The Bhattacharyya coefficient between two histograms is the dot product of their
+        normalized square roots, so stacking them allows all comparisons against a histogram to be
+        performed in a single matrix multiplication. The Bhattacharyya distance, as calculated by
+        :func:`cv2.compareHist`, is then ``sqrt(1 - coefficient)``.
+
+        Parameters
+        ----------
+        histograms: list
+            List of histograms as returned from :func:`cv2.calcHist`
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            The (`N`, `bins`) normalized square root of each histogram
+        """
+        if not histograms:
+            return np.zeros((0, 256), dtype="float32")
+        hists = np.stack(histograms).reshape(len(histograms), -1).astype("float32")
+        hists /= hists.sum(axis=1, keepdims=True) + 1e-12
+        return np.sqrt(hists)
+
     @staticmethod
     def _convert_color(imgs, same_size, method):
-        """ Helper function to convert color spaces """
+        """ Helper function to convert color spaces
+
+        Parameters
+        ----------
+        imgs: :class:`numpy.ndarray` or list
+            A stacked (`N`, `height`, `width`, `channels`) batch of images if :attr:`same_size` is
+            ``True`` otherwise a list of images. Images can be of any data type, as the conversion
+            to float occurs as part of the color space conversion
+        same_size: bool
+            ``True`` if :attr:`imgs` is a stacked batch of images of the same size
+        method: str
+            The color sorting method that is being performed
+
+        Returns
+        -------
+        :class:`numpy.ndarray` or list
+            The converted float32 batch of images if :attr:`same_size` is ``True`` otherwise a list
+            of converted float32 images
+        """
 
         if method.endswith('gray'):
-            conversion = np.array([[0.0722], [0.7152], [0.2126]])
+            conversion = np.array([[0.0722], [0.7152], [0.2126]], dtype='float32')
         else:
-            conversion = np.array([[0.25, 0.5, 0.25], [-0.5, 0.0, 0.5], [-0.25, 0.5, -0.25]])
+            conversion = np.array([[0.25, 0.5, 0.25], [-0.5, 0.0, 0.5], [-0.25, 0.5, -0.25]],
+                                  dtype='float32').T
 
         if same_size:
-            path = 'greedy'
-            operation = 'bijk, kl -> bijl' if method.endswith('gray') else 'bijl, kl -> bijk'
-        else:
-            operation = 'ijk, kl -> ijl' if method.endswith('gray') else 'ijl, kl -> ijk'
-            path = np.einsum_path(operation, imgs[0][..., :3], conversion, optimize='optimal')[0]
-
-        progress_bar = tqdm(imgs, desc="Converting", file=sys.stdout)
-        images = [np.einsum(operation, img[..., :3], conversion, optimize=path).astype('float32')
-                  for img in progress_bar]
+            return imgs[..., :3] @ conversion
+
+        # Convert each set of images that share the same dimensions as a single batch
+        shapes = {}
+        for idx, img in enumerate(imgs):
+            shapes.setdefault(img.shape, []).append(idx)
+        images = [None] * len(imgs)
+        for indices in tqdm(shapes.values(), desc="Converting", file=sys.stdout):
+            batch = np.stack([imgs[idx] for idx in indices])[..., :3]
+            for idx, image in zip(indices, batch @ conversion):
+                images[idx] = image
         return images
 
     @staticmethod
@@ -789,27 +1142,19 @@ class Sort():
         :return: list that is sorted in the same way as the input sorted list
         but the values corresponding to each image are from new_vals_list.
         """
-        new_list = []
-        # Make new list of just image paths to serve as an index
-        val_index_list = [i[0] for i in new_vals_list]
-        for i in tqdm(range(len(sorted_list)), desc="Splicing", file=sys.stdout):
-            current_img = sorted_list[i] if isinstance(sorted_list[i], str) else sorted_list[i][0]
-            new_val_index = val_index_list.index(current_img)
-            new_list.append([current_img, new_vals_list[new_val_index][1]])
-
+        # Map each image path to its new value to serve as an index
+        lookup = {entry[0]: entry[1] for entry in new_vals_list}
+        img_paths = (item if isinstance(item, str) else item[0] for item in sorted_list)
+        new_list = [[img_path, lookup[img_path]] for img_path in img_paths]
         return new_list
 
     @staticmethod
     def find_images(input_dir):
         """ Return list of images at specified location """
-        result = []
-        extensions = [".jpg", ".png", ".jpeg"]
-        for root, _, files in os.walk(input_dir):
-            for file in files:
-                if os.path.splitext(file)[1].lower() in extensions:
-                    result.append(os.path.join(root, file))
-            break
-        return result
+        with os.scandir(input_dir) as entries:
+            return [entry.path for entry in entries
+                    if os.path.splitext(entry.name)[1].lower() in _IMAGE_EXTENSIONS
+                    and entry.is_file()]
 
     @classmethod
     def estimate_blur(cls, image, metadata=None):
@@ -830,26 +1175,8 @@ class Sort():
         float
             The estimated blur score for the face
         """
-        if metadata is not None:
-            alignments = metadata["alignments"]
-            det_face = DetectedFace()
-            det_face.from_png_meta(alignments)
-            aln_face = AlignedFace(np.array(alignments["landmarks_xy"], dtype="float32"),
-                                   image=image,
-                                   centering="legacy",
-                                   size=256,
-                                   is_aligned=True)
-            mask = det_face.mask["components"]
-            mask.set_sub_crop(aln_face.pose.offset[mask.stored_centering],
-                              aln_face.pose.offset["legacy"],
-                              centering="legacy")
-            mask = cv2.resize(mask.mask, (256, 256), interpolation=cv2.INTER_CUBIC)[..., None]
-            image = np.minimum(aln_face.face, mask)
-        if image.ndim == 3:
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        blur_map = cv2.Laplacian(image, cv2.CV_32F)
-        score = np.var(blur_map) / np.sqrt(image.shape[0] * image.shape[1])
-        return score
+        image = cls._get_blur_image(image, metadata)
+        return cls._laplacian_blur_scores(image[None])[0]
 
     @classmethod
     def estimate_blur_fft(cls, image, metadata=None):
@@ -873,33 +1200,255 @@ class Sort():
         float
             The estimated fft blur score for the face
         """
+        image = cls._get_blur_image(image, metadata)
+        return cls._fft_blur_scores(image[None])[0]
+
+    @staticmethod
+    def _landmarks_from_alignments(alignments):
+        """ Obtain the landmarks from a face's png header alignments as a float32 array.
+
+        The converted array is stored back into the given alignments, so that the landmarks are
+        only ever converted once for each face, and no copy is made if the landmarks are already
+        a float32 array.
+
+        Parameters
+        ----------
+        alignments: dict
+            The alignments for a face, as stored in its png header
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            The (68, 2) float32 landmarks for the face
+        """
+        landmarks = np.asarray(alignments["landmarks_xy"], dtype="float32")
+        alignments["landmarks_xy"] = landmarks
+        return landmarks
+
+    @classmethod
+    def _get_blur_image(cls, image, metadata=None):
+        """ Obtain the grayscale image to calculate blur for.
+
+        Parameters
+        ----------
+        image: :class:`numpy.ndarray`
+            The face image to calculate blur for
+        metadata: dict, optional
+            The metadata for the face image or ``None`` if no metadata is available. If metadata is
+            provided the face will be masked by the "components" mask. Default:``None``
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            The (optionally masked) grayscale face image
+        """
         if metadata is not None:
-            alignments = metadata["alignments"]
-            det_face = DetectedFace()
-            det_face.from_png_meta(alignments)
-            aln_face = AlignedFace(np.array(alignments["landmarks_xy"], dtype="float32"),
-                                   image=image,
-                                   centering="legacy",
-                                   size=256,
-                                   is_aligned=True)
-            mask = det_face.mask["components"]
-            mask.set_sub_crop(aln_face.pose.offset[mask.stored_centering],
-                              aln_face.pose.offset["legacy"],
-                              centering="legacy")
-            mask = cv2.resize(mask.mask, (256, 256), interpolation=cv2.INTER_CUBIC)[..., None]
-            image = np.minimum(aln_face.face, mask)
+            _, _, aligned = cls._prepare_blur_face(None, image, metadata)
+            image = cls._apply_blur_mask(*aligned)
         if image.ndim == 3:
             image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        height, width = image.shape
-        c_height, c_width = (int(height / 2.0), int(width / 2.0))
-        fft = np.fft.fft2(image)
-        fft_shift = np.fft.fftshift(fft)
-        fft_shift[c_height - 75:c_height + 75, c_width - 75:c_width + 75] = 0
-        ifft_shift = np.fft.ifftshift(fft_shift)
-        shift_back = np.fft.ifft2(ifft_shift)
-        magnitude = np.log(np.abs(shift_back))
-        score = np.mean(magnitude)
-        return score
+        return image
+
+    @classmethod
+    def _prepare_blur_face(cls, filename, image, metadata):
+        """ Align a face and load its components mask from the face's metadata, ready for masking
+        with :func:`_apply_blur_mask`.
+
+        Parameters
+        ----------
+        filename: str
+            The filename of the face image. Passed through to the output
+        image: :class:`numpy.ndarray`
+            The face image to calculate blur for
+        metadata: dict
+            The metadata for the face image or ``None`` if no metadata is available
+
+        Returns
+        -------
+        filename: str
+            The filename of the face image
+        image: :class:`numpy.ndarray` or ``None``
+            The face image if no metadata is available, otherwise ``None``
+        aligned: tuple or ``None``
+            The :class:`lib.align.AlignedFace` and the components :class:`lib.align.Mask` cropped
+            to legacy centering for the face, or ``None`` if no metadata is available
+        """
+        if metadata is None:
+            return filename, image, None
+        alignments = metadata["alignments"]
+        aln_face = AlignedFace(cls._landmarks_from_alignments(alignments),
+                               image=image,
+                               centering="legacy",
+                               size=256,
+                               is_aligned=True)
+        # Only the components mask is required, so don't populate a full DetectedFace
+        mask = Mask()
+        mask.from_dict(alignments["mask"]["components"])
+        mask.set_sub_crop(aln_face.pose.offset[mask.stored_centering],
+                          aln_face.pose.offset["legacy"],
+                          centering="legacy")
+        return filename, None, (aln_face, mask)
+
+    @staticmethod
+    def _apply_blur_mask(aligned_face, mask, mask_buffer=None):
+        """ Apply the components mask to an aligned face.
+
+        Parameters
+        ----------
+        aligned_face: :class:`lib.align.AlignedFace`
+            The 256px legacy centered aligned face to mask. The face is masked in place
+        mask: :class:`lib.align.Mask`
+            The components mask for the face, cropped to legacy centering
+        mask_buffer: :class:`numpy.ndarray`, optional
+            A (256, 256) uint8 array to resize the mask into, so that a new mask does not need to
+            be allocated for each face. ``None`` to allocate a new mask. Default: ``None``
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            The masked face image
+        """
+        mask = cv2.resize(mask.mask,
+                          (256, 256),
+                          dst=mask_buffer,
+                          interpolation=cv2.INTER_CUBIC)[..., None]
+        return np.minimum(aligned_face.face, mask, out=aligned_face.face)
+
+    @staticmethod
+    def _batch_to_gray(images):
+        """ Convert a batch of BGR images to grayscale with a single call to :func:`cv2.cvtColor`.
+
+        Parameters
+        ----------
+        images: :class:`numpy.ndarray`
+            The (`N`, `height`, `width`, 3) batch of BGR images or the (`N`, `height`, `width`)
+            batch of images that are already grayscale
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            The (`N`, `height`, `width`) batch of grayscale images
+        """
+        if images.ndim == 3:
+            return images
+        num_images, height, width = images.shape[:3]
+        # Images are stacked vertically so the whole batch is converted as a single image
+        gray = cv2.cvtColor(images.reshape(num_images * height, width, -1), cv2.COLOR_BGR2GRAY)
+        return gray.reshape(num_images, height, width)
+
+    @staticmethod
+    def _laplacian_blur_scores(images):
+        """ Calculate the variance of the Laplacian blur score for a batch of images.
+
+        Parameters
+        ----------
+        images: :class:`numpy.ndarray`
+            The (`N`, `height`, `width`) batch of grayscale images to score
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            The (`N`, ) blur scores for the batch
+        """
+        blur_map = np.empty(images.shape[1:], dtype="float32")
+        scores = np.empty(images.shape[0], dtype="float64")
+        for idx, image in enumerate(images):
+            cv2.Laplacian(image, cv2.CV_32F, dst=blur_map)
+            # Single pass calculation of the standard deviation, reusing the Laplacian buffer
+            scores[idx] = cv2.meanStdDev(blur_map)[1][0, 0] ** 2
+        return scores / np.sqrt(images.shape[1] * images.shape[2])
+
+    @classmethod
+    def _fft_blur_scores(cls, images):
+        """ Calculate the fft filtered blur score for a batch of images.
+
+        Parameters
+        ----------
+        images: :class:`numpy.ndarray`
+            The (`N`, `height`, `width`) batch of grayscale images to score
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            The (`N`, ) fft blur scores for the batch
+        """
+        height, width = images.shape[1:]
+        low_frequencies = np.ix_(cls._fft_band_indices(height), cls._fft_band_indices(width))
+        image = np.empty((height, width), dtype="float32")
+        scores = np.empty(images.shape[0], dtype="float64")
+        # Each face is transformed individually, as per face cv2.dft calls were measured to be
+        # faster than a single batched scipy.fft transform of the stacked faces
+        for idx, img in enumerate(images):
+            image[...] = img
+            spectrum = cv2.dft(image, flags=cv2.DFT_COMPLEX_OUTPUT)
+            spectrum[low_frequencies] = 0
+            high_pass = cv2.idft(spectrum, flags=cv2.DFT_SCALE)
+            magnitude = cv2.magnitude(high_pass[..., 0], high_pass[..., 1])
+            scores[idx] = np.log(magnitude, out=magnitude).mean()
+        return scores
+
+    @staticmethod
+    def _fft_band_indices(size):
+        """ Obtain the indices of the low frequency band to remove from one axis of an unshifted
+        spectrum when calculating the fft blur score.
+
+        The band is the central 150 entries of the shifted spectrum, taken with the same slice
+        bounds as a shifted spectrum would be, so that axes shorter than 150 px remove the same
+        frequencies as the shifted calculation rather than the whole axis.
+
+        Parameters
+        ----------
+        size: int
+            The length of the spectrum axis
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            The indices of the low frequency band within the unshifted spectrum axis
+        """
+        center = size // 2
+        return (np.arange(size)[center - 75:center + 75] - center) % size
+
+    @staticmethod
+    def calc_histogram(image):
+        """ Calculate the histogram of the first channel of an image.
+
+        Counting the values with :func:`numpy.bincount` is faster than :func:`cv2.calcHist` for
+        single channel 8 bit data.
+
+        Parameters
+        ----------
+        image: :class:`numpy.ndarray`
+            The uint8 image to calculate the histogram for
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            The (256, 1) float32 histogram, in the same format as returned by :func:`cv2.calcHist`
+        """
+        channel = image[..., 0] if image.ndim == 3 else image
+        histogram = np.bincount(channel.ravel(), minlength=256)
+        return histogram.astype("float32").reshape(256, 1)
+
+    @staticmethod
+    def calc_black_pixels(image):
+        """ Calculate the percentage of pure black pixels in an image, multiplied by 3 channels.
+
+        The channels are combined with a bitwise OR so that black pixels are counted in a single
+        pass, without creating a full size boolean comparison array.
+
+        Parameters
+        ----------
+        image: :class:`numpy.ndarray`
+            The 3 channel BGR image to count the black pixels for
+
+        Returns
+        -------
+        float
+            The percentage of black pixels in the image, multiplied by 3
+        """
+        combined = image[..., 0] | image[..., 1] | image[..., 2]
+        return float(np.count_nonzero(combined == 0)) * 300.0 / image.size
 
     @staticmethod
     def calc_landmarks_face_pitch(flm):
@@ -910,13 +1459,22 @@ class Sort():
 
     @staticmethod
     def calc_landmarks_face_yaw(flm):
-        """ Calculate the amount of yaw in a face """
-        var_l = ((flm[27][0] - flm[0][0])
-                 + (flm[28][0] - flm[1][0])
-                 + (flm[29][0] - flm[2][0])) / 3.0
-        var_r = ((flm[16][0] - flm[27][0])
-                 + (flm[15][0] - flm[28][0])
-                 + (flm[14][0] - flm[29][0])) / 3.0
+        """ Calculate the amount of yaw in a face, or in a batch of faces.
+
+        Parameters
+        ----------
+        flm: :class:`numpy.ndarray`
+            The (68, 2) landmarks for a single face or the (`N`, 68, 2) landmarks for a batch
+            of faces. Landmarks are processed as float32
+
+        Returns
+        -------
+        float or :class:`numpy.ndarray`
+            The yaw of the face, or the (`N`, ) yaws for a batch of faces
+        """
+        flm = np.asarray(flm, dtype="float32")
+        var_l = (flm[..., 27:30, 0] - flm[..., 0:3, 0]).sum(axis=-1) / 3.0
+        var_r = (flm[..., 16:13:-1, 0] - flm[..., 27:30, 0]).sum(axis=-1) / 3.0
         return var_r - var_l
 
     @staticmethod
@@ -928,79 +1486,244 @@ class Sort():
         Relevant cli arguments: -k, -l
         :return: function reference
         """
-        if log_changes:
-            if keep_original:
-                def process_file(src, dst, changes):
-                    """ Process file method if logging changes
-                        and keeping original """
-                    copyfile(src, dst)
-                    changes[src] = dst
-
-            else:
-                def process_file(src, dst, changes):
-                    """ Process file method if logging changes
-                        and not keeping original """
-                    os.rename(src, dst)
-                    changes[src] = dst
-
-        else:
-            if keep_original:
-                def process_file(src, dst, changes):  # pylint: disable=unused-argument
-                    """ Process file method if not logging changes
-                        and keeping original """
-                    copyfile(src, dst)
-
-            else:
-                def process_file(src, dst, changes):  # pylint: disable=unused-argument
-                    """ Process file method if not logging changes
-                        and not keeping original """
-                    os.rename(src, dst)
-        return process_file
+        return _PROCESS_FILE_METHODS[(bool(log_changes), bool(keep_original))]
 
     @staticmethod
     def set_renaming_method(log_changes):
         """ Set the method for renaming files """
-        if log_changes:
-            def renaming(src, output_dir, i, changes):
-                """ Rename files  method if logging changes """
-                src_basename = os.path.basename(src)
+        return _rename_file_log if log_changes else _rename_file
 
-                __src = os.path.join(output_dir,
-                                     f"{i:05d}_{src_basename}")
-                dst = os.path.join(
-                    output_dir,
-                    f"{i:05d}{os.path.splitext(src_basename)[1]}")
-                changes[src] = dst
-                return __src, dst
-        else:
-            def renaming(src, output_dir, i, changes):  # pylint: disable=unused-argument
-                """ Rename files method if not logging changes """
-                src_basename = os.path.basename(src)
+    @staticmethod
+    def get_avg_score_hist(hist_root, references):
+        """ Return the average Bhattacharyya distance between a face's histogram and the
+        histograms of a group of reference images.
 
-                src = os.path.join(output_dir,
-                                   f"{i:05d}_{src_basename}")
-                dst = os.path.join(
-                    output_dir,
-                    f"{i:05d}{os.path.splitext(src_basename)[1]}")
-                return src, dst
-        return renaming
+        Parameters
+        ----------
+        hist_root: :class:`numpy.ndarray`
+            The normalized histogram root, as returned from
+            :func:`_normalized_histogram_roots`, for the face to score
+        references: :class:`numpy.ndarray`
+            The (`N`, `bins`) normalized histogram roots for the reference images
 
-    @staticmethod
-    def get_avg_score_hist(img1, references):
-        """ Return the average histogram score between a face and
-            reference image """
-        scores = []
-        for img2 in references:
-            score = cv2.compareHist(img1, img2, cv2.HISTCMP_BHATTACHARYYA)
-            scores.append(score)
-        return sum(scores) / len(scores)
+        Returns
+        -------
+        float
+            The average Bhattacharyya distance between the face and the references
+        """
+        return float(np.sqrt(np.clip(1.0 - references @ hist_root, 0.0, None)).mean())
 
     @staticmethod
     def get_avg_score_faces_cnn(fl1, references):
-        """ Return the average CNN similarity score
-            between a face and reference image """
-        scores = []
-        for fl2 in references:
-            score = np.sum(np.absolute((fl2 - fl1).flatten()))
-            scores.append(score)
-        return sum(scores) / len(scores)
+        """ Return the average CNN similarity score between a face and a group of reference
+        images.
+
+        Parameters
+        ----------
+        fl1: :class:`numpy.ndarray`
+            The flattened landmarks for the face to score
+        references: :class:`numpy.ndarray`
+            The (`N`, `landmarks`) flattened landmarks for the reference images. The distances are
+            calculated as float32
+
+        Returns
+        -------
+        float
+            The average L1 distance between the face and the references
+        """
+        distances = np.subtract(references, fl1, dtype="float32")
+        np.abs(distances, out=distances)
+        return float(distances.sum()) / distances.shape[0]
+
+
+def _copy_file(src, dst, changes):  # pylint: disable=unused-argument
+    """ Process file method if not logging changes and keeping original """
+    copy(src, dst)
+
+
+def _copy_file_log(src, dst, changes):
+    """ Process file method if logging changes and keeping original """
+    copy(src, dst)
+    changes[src] = dst
+
+
+def _move_file(src, dst, changes):  # pylint: disable=unused-argument
+    """ Process file method if not logging changes and not keeping original """
+    os.rename(src, dst)
+
+
+def _move_file_log(src, dst, changes):
+    """ Process file method if logging changes and not keeping original """
+    os.rename(src, dst)
+    changes[src] = dst
+
+
+_PROCESS_FILE_METHODS = {(True, True): _copy_file_log,
+                         (True, False): _move_file_log,
+                         (False, True): _copy_file,
+                         (False, False): _move_file}
+
+
+def _rename_file(src, output_dir, i, changes):  # pylint: disable=unused-argument
+    """ Rename files method if not logging changes. Returns the temporary and final destination of
+    the file """
+    stem, extension = os.path.splitext(os.path.basename(src))
+    temp = os.path.join(output_dir, f"{i:05d}_{stem}{extension}")
+    dst = os.path.join(output_dir, f"{i:05d}{extension}")
+    return temp, dst
+
+
+def _rename_file_log(src, output_dir, i, changes):
+    """ Rename files method if logging changes. Returns the temporary and final destination of the
+    file """
+    temp, dst = _rename_file(src, output_dir, i, changes)
+    changes[src] = dst
+    return temp, dst
+
+
+class _GrowableArray():
+    """ A contiguous array that rows can be appended to, which doubles its capacity when full.
+
+    Parameters
+    ----------
+    row_shape: tuple
+        The shape of each row that will be appended to the array
+    dtype: str, optional
+        The data type of the array. Default: `"float32"`
+    capacity: int, optional
+        The initial number of rows to allocate. Default: `16`
+    """
+    def __init__(self, row_shape, dtype="float32", capacity=16):
+        self._data = np.empty((capacity, *row_shape), dtype=dtype)
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def view(self):
+        """ :class:`numpy.ndarray`: A view of the rows that have been appended to the array """
+        return self._data[:self._length]
+
+    def append(self, row):
+        """ Append a row to the end of the array, growing the underlying buffer if required.
+
+        Parameters
+        ----------
+        row: :class:`numpy.ndarray`
+            The row to append to the array
+        """
+        if self._length == self._data.shape[0]:
+            self._data = np.concatenate([self._data, np.empty_like(self._data)])
+        self._data[self._length] = row
+        self._length += 1
+
+
+class _HistogramCache():
+    """ Persistent store of the grayscale histograms for the images within a folder.
+
+    Histograms are held in a single memory mapped ``.npy`` file, with a json index that maps each
+    image's filename to its modification time, file size, inode and row within the histogram
+    array. A cached histogram is only returned if the image has not changed since it was cached.
+    The inode is included as renaming a file keeps its modification time and size, so a sort that
+    renames images in place could otherwise give a stale histogram to a different image that has
+    been renamed to the same filename.
+
+    Parameters
+    ----------
+    folder: str
+        The folder containing the images that histograms are to be cached for
+    """
+    def __init__(self, folder):
+        self._histogram_file = os.path.join(folder, ".fs_hists.npy")
+        self._index_file = os.path.join(folder, ".fs_hists.json")
+        self._serializer = get_serializer("json")
+        self._histograms, self._index = self._load()
+
+    def __len__(self):
+        """ int: The number of histograms held in the cache """
+        return len(self._index)
+
+    def _load(self):
+        """ Load the cached histograms and their index from disk.
+
+        Returns
+        -------
+        histograms: :class:`numpy.ndarray` or ``None``
+            The memory mapped cached histograms or ``None`` if there is no valid cache
+        index: dict
+            Dictionary of image filename to [`modified time`, `size`, `inode`, `row`]
+        """
+        if not os.path.exists(self._histogram_file) or not os.path.exists(self._index_file):
+            return None, {}
+        try:
+            index = self._serializer.load(self._index_file)
+            histograms = np.load(self._histogram_file, mmap_mode="r")
+        except (FaceswapError, OSError, ValueError) as err:
+            logger.debug("Unable to load histogram cache: %s", str(err))
+            return None, {}
+        if len(index) != histograms.shape[0]:
+            logger.debug("Histogram cache is out of sync with its index. Ignoring")
+            return None, {}
+        logger.debug("Loaded histogram cache: (histograms: %s, index: %s)",
+                     histograms.shape, len(index))
+        return histograms, index
+
+    @staticmethod
+    def _file_stats(filename):
+        """ list: The modification time (in nanoseconds), size and inode of the given file """
+        stats = os.stat(filename)
+        return [stats.st_mtime_ns, stats.st_size, stats.st_ino]
+
+    def get(self, filename):
+        """ Obtain the cached histogram for an image.
+
+        Parameters
+        ----------
+        filename: str
+            The full path to the image to obtain the histogram for
+
+        Returns
+        -------
+        :class:`numpy.ndarray` or ``None``
+            The cached (256, 1) histogram for the image or ``None`` if the image does not exist in
+            the cache or has been modified since it was cached
+        """
+        entry = self._index.get(os.path.basename(filename))
+        if entry is None or entry[:-1] != self._file_stats(filename):
+            return None
+        return np.array(self._histograms[entry[-1]]).reshape(-1, 1)
+
+    def save(self, histograms):
+        """ Replace the cache with the given histograms. Failures are logged but not raised, as the
+        cache is not required for sorting. If no histograms are given, the cache is removed.
+
+        Parameters
+        ----------
+        histograms: list
+            List of (`filename`, `histogram`) tuples to store in the cache
+        """
+        index = {os.path.basename(filename): self._file_stats(filename) + [idx]
+                 for idx, (filename, _) in enumerate(histograms)}
+        temp_files = [f"{self._histogram_file}.tmp.npy", f"{self._index_file}.tmp.json"]
+        self._histograms, self._index = None, {}  # Release the memory map prior to replacing
+        try:
+            if histograms:
+                np.save(temp_files[0], np.stack([hist for _, hist in histograms]))
+                self._serializer.save(temp_files[1], index)
+            # Remove the old index first so that an interrupted save can only invalidate the cache
+            if os.path.exists(self._index_file):
+                os.remove(self._index_file)
+            if histograms:
+                os.replace(temp_files[0], self._histogram_file)
+                os.replace(temp_files[1], self._index_file)
+            elif os.path.exists(self._histogram_file):
+                os.remove(self._histogram_file)
+        except (FaceswapError, OSError) as err:
+            logger.warning("Unable to save histogram cache: %s", str(err))
+            for filename in temp_files:
+                if os.path.exists(filename):
+                    os.remove(filename)
+            return
+        self._histograms, self._index = self._load()
+        logger.debug("Saved histogram cache: %s", len(index))